@@ -5,113 +5,539 @@ FileSync – One-way sync from source(s) to destination
 
 Behavior:
   • Copies missing files from source(s) to destination (preserving structure)
-  • Skips files that already exist with identical content (SHA256)
+  • Skips files that already exist with identical content (SHA256, or BLAKE3 with --hash blake3)
   • When file exists but content differs → saves new version as filename_1.ext, _2.ext, …
   • Never deletes any files
   • Supports multiple source directories
 """
 
 import argparse
+import concurrent.futures
 import datetime
+import errno
 import hashlib
+import mmap
 import os
+import re
 import shutil
 import sqlite3
 import sys
+import threading
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import blake3
+except ImportError:  # optional, only needed for --hash blake3
+    blake3 = None
+
+
+CHUNK_SIZE = 1 << 20  # 1 MiB reads when streaming into the hasher
+MMAP_THRESHOLD = 16 << 20  # larger files are hashed straight from a mapping
+QUICK_BYTES = 4096  # head and tail sampled by quick_fingerprint
+HASH_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+PREFETCH_AHEAD = HASH_WORKERS  # files queued behind the busy hash workers
+PREFETCH_BYTES = 4 << 20  # only the head of each file; readahead covers the rest
+COPY_WORKERS = 32  # copies in flight; keeps the device queue busy
+
+# Linux reflink ioctl; exposed as fcntl.FICLONE only from Python 3.12
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409) if fcntl and sys.platform.startswith("linux") else None
+# copy_file_range errors meaning "not possible here", not "copy failed"
+KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+
+def cpu_has_sha_extensions():
+    """True if the CPU advertises SHA-256 instructions (x86 SHA-NI, ARMv8 SHA2).
+
+    Only detectable from /proc/cpuinfo (Linux); elsewhere returns False.
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpuinfo = f.read()
+    except OSError:
+        return False
+    return re.search(r"\b(sha_ni|sha2)\b", cpuinfo) is not None
+
+
+def hashlib_openssl_is_old():
+    """True if hashlib is likely built on OpenSSL < 1.1, which lacks SHA-NI dispatch."""
+    try:
+        import ssl
+    except ImportError:
+        # No OpenSSL at all: hashlib falls back to its builtin SHA-256
+        return True
+    return ssl.OPENSSL_VERSION_INFO < (1, 1)
+
+
+def import_crypto_hashes():
+    """The cryptography package's hashes module, or None if it is not installed."""
+    try:
+        from cryptography.hazmat.primitives import hashes
+    except ImportError:  # optional, see USE_CRYPTOGRAPHY_SHA256
+        return None
+    return hashes
+
+
+# Prefer the cryptography package's (newer) libcrypto only when it can
+# actually use SHA instructions that hashlib's OpenSSL would leave idle;
+# only then is it worth importing
+crypto_hashes = (
+    import_crypto_hashes() if cpu_has_sha_extensions() and hashlib_openssl_is_old() else None
+)
+USE_CRYPTOGRAPHY_SHA256 = crypto_hashes is not None
+
+
+def prefetch(filepath):
+    """Ask the kernel to start reading a file's first PREFETCH_BYTES into the page cache (POSIX only)."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(filepath, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, PREFETCH_BYTES, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+
+_local = threading.local()
+
+
+def _read_buffer():
+    """This thread's CHUNK_SIZE scratch buffer, allocated once and reused for every file."""
+    buf = getattr(_local, "read_buffer", None)
+    if buf is None:
+        buf = _local.read_buffer = memoryview(bytearray(CHUNK_SIZE))
+    return buf
+
 
 def compute_sha256(filepath):
     """Compute SHA256 hash of a file. Returns None on error."""
     filepath = Path(filepath)
-    h = hashlib.sha256()
     try:
-        with filepath.open("rb") as f:
-            for chunk in iter(lambda: f.read(32768), b""):
-                h.update(chunk)
-        return h.hexdigest()
+        with filepath.open("rb", buffering=0) as f:
+            if hasattr(os, "posix_fadvise"):
+                # Whole file, front to back: allow a larger readahead window
+                try:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                except OSError:
+                    pass
+            if USE_CRYPTOGRAPHY_SHA256:
+                h = crypto_hashes.Hash(crypto_hashes.SHA256())
+                buf = _read_buffer()
+                while n := f.readinto(buf):
+                    h.update(buf[:n])
+                return h.finalize().hex()
+            if os.fstat(f.fileno()).st_size > MMAP_THRESHOLD:
+                try:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except (OSError, ValueError):
+                    # Some mounts (FUSE, direct_io) refuse mmap: read() below
+                    mm = None
+                if mm is not None:
+                    # hashlib reads the mapped pages directly: no read() copy
+                    with mm:
+                        if hasattr(mmap, "MADV_SEQUENTIAL"):
+                            mm.madvise(mmap.MADV_SEQUENTIAL)
+                        return hashlib.sha256(mm).hexdigest()
+            # readinto() refills the same buffer: no new bytes object per chunk
+            h = hashlib.sha256()
+            buf = _read_buffer()
+            while n := f.readinto(buf):
+                h.update(buf[:n])
+            return h.hexdigest()
+    except (OSError, IOError) as e:
+        print(f"  Error hashing {filepath}: {e}", file=sys.stderr)
+        return None
+
+
+def walk_files(root, listings=None):
+    """Yield (path, rel_path, stat) for each file under root via os.scandir; records dir listings if given."""
+    stack = [(os.fspath(root), "")]
+    while stack:
+        top, prefix = stack.pop()
+        try:
+            with os.scandir(top) as it:
+                names = listings.setdefault(top, set()) if listings is not None else None
+                for entry in it:
+                    if names is not None:
+                        names.add(entry.name)
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((entry.path, prefix + entry.name + os.sep))
+                        elif entry.is_file():
+                            st = entry.stat()
+                            if not st.st_ino:
+                                # Windows DirEntry stats lack inode/device
+                                st = os.stat(entry.path)
+                            yield entry.path, prefix + entry.name, st
+                    except OSError as e:
+                        print(f"  Skip {entry.path}: {e}", file=sys.stderr)
+        except OSError as e:
+            print(f"  Cannot read directory {top}: {e}", file=sys.stderr)
+
+
+def stat_key(st):
+    """(dev, inode, size, mtime_ns) identifying a file's current contents."""
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def quick_fingerprint(filepath):
+    """SHA256 of a file's first and last QUICK_BYTES (whole file if small). Returns None on error."""
+    try:
+        with open(filepath, "rb") as f:
+            data = f.read(QUICK_BYTES)
+            if os.fstat(f.fileno()).st_size > 2 * QUICK_BYTES:
+                f.seek(-QUICK_BYTES, os.SEEK_END)
+            data += f.read(QUICK_BYTES)
+        return hashlib.sha256(data).hexdigest()
+    except (OSError, IOError) as e:
+        print(f"  Error hashing {filepath}: {e}", file=sys.stderr)
+        return None
+
+
+def compute_blake3(filepath):
+    """Compute BLAKE3 hash of a file (multi-threaded, via mmap). Returns None on error."""
+    try:
+        hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+        return hasher.update_mmap(os.fspath(filepath)).hexdigest()
     except (OSError, IOError) as e:
         print(f"  Error hashing {filepath}: {e}", file=sys.stderr)
         return None
 
 
+HASH_FUNCTIONS = {
+    "sha256": compute_sha256,
+    "blake3": compute_blake3,
+    "quick": quick_fingerprint,  # internal prefilter, not a --hash choice
+}
+
+
+def hash_files(paths, stats, cursor=None, hash_algo="sha256", prefetch_ahead=True):
+    """Hash files concurrently, reusing cached hashes by stat key. Returns hashes in path order."""
+    compute_hash = HASH_FUNCTIONS[hash_algo]
+    hashes = [None] * len(paths)
+    keys = [stat_key(st) for st in stats] if cursor else [None] * len(paths)
+
+    misses = []
+    new_rows = []
+    for i, key in enumerate(keys):
+        if key is not None:
+            cursor.execute(
+                "SELECT file_hash FROM file_cache WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ? AND algo = ?",
+                (*key, hash_algo),
+            )
+            row = cursor.fetchone()
+            if row:
+                hashes[i] = row[0]
+                continue
+        misses.append(i)
+
+    # Largest first, so the pool does not finish on one long file while
+    # the other workers sit idle
+    misses.sort(key=lambda i: stats[i].st_size, reverse=True)
+    todo = [paths[i] for i in misses]
+
+    def hash_and_prefetch(j):
+        # Warm the page cache for the file a worker will pick up next
+        if prefetch_ahead and j + PREFETCH_AHEAD < len(todo):
+            prefetch(todo[j + PREFETCH_AHEAD])
+        return compute_hash(todo[j])
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=HASH_WORKERS) as ex:
+        computed = ex.map(hash_and_prefetch, range(len(todo)))
+        for i, h in zip(misses, computed):
+            hashes[i] = h
+            if h and keys[i] is not None:
+                new_rows.append((*keys[i], hash_algo, h))
+
+    if new_rows:
+        cursor.executemany(
+            "INSERT OR REPLACE INTO file_cache (dev, inode, size, mtime_ns, algo, file_hash) VALUES (?, ?, ?, ?, ?, ?)",
+            new_rows,
+        )
+    return hashes
+
+
 def get_or_create_db(db_path):
-    """Create or open SQLite DB with files table."""
+    """Create or open SQLite DB with the file_cache (stat key → hash) table."""
     conn = sqlite3.connect(db_path)
+    # The DB is only a cache: trade durability for far fewer fsyncs
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")  # 64 MiB
     cursor = conn.cursor()
+    # A cache kept by an older version has no algo column; just rebuild it
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(file_cache)")}
+    if columns and "algo" not in columns:
+        cursor.execute("DROP TABLE file_cache")
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS dest_hashes (
-            rel_path TEXT PRIMARY KEY,
+        CREATE TABLE IF NOT EXISTS file_cache (
+            dev INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            algo TEXT NOT NULL,
             file_hash TEXT NOT NULL
         )
     """)
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_file_cache_stat
+        ON file_cache (dev, inode, size, mtime_ns, algo)
+    """)
     conn.commit()
     return conn
 
 
-def build_destination_index( destination, conn, cursor):
-    """Scan destination once and store relative path → hash."""
+def split_suffix(name):
+    """Split a file name into (stem, suffix) the way pathlib does."""
+    i = name.rfind(".")
+    if 0 < i < len(name) - 1:
+        return name[:i], name[i:]
+    return name, ""
+
+
+def suffixed_name(stem, suffix, i):
+    """The i-th conflict name for a file split into (stem, suffix)."""
+    return f"{stem}_{i}{suffix}"
+
+
+def name_families(rel_path):
+    """Conflict-name families (dir, stem, suffix) of a relative path; its own family comes first."""
+    head, name = os.path.split(rel_path)
+    families = [(head, *split_suffix(name))]
+    # Every (stem, suffix) whose suffixed_name() could produce this name:
+    # "a_2.txt" comes from ("a", ".txt"), "x._1" from ("x.", "")
+    for stem, suffix in ((name, ""), split_suffix(name)):
+        m = re.fullmatch(r"(.+)_\d+", stem, re.S)
+        if m and (head, m.group(1), suffix) not in families:
+            families.append((head, m.group(1), suffix))
+    return families
+
+
+def _colliding(items):
+    """Indexes from (index, buckets) pairs that share a bucket with another index."""
+    members = {}
+    for i, buckets in items:
+        for bucket in buckets:
+            members.setdefault(bucket, []).append(i)
+    found = set()
+    for group in members.values():
+        if len(group) > 1:
+            found.update(group)
+    return sorted(found)
+
+
+def content_keys(paths, stats, cursor=None, hash_algo="sha256", families=None):
+    """One key per file, equal only for equal content among files sharing a family (None if unreadable)."""
+    keys = [(st.st_size,) for st in stats]
+    if families is None:
+        families = [((),)] * len(paths)
+
+    need_quick = _colliding(
+        (i, [(family, st.st_size) for family in families[i]]) for i, st in enumerate(stats)
+    )
+
+    quick = hash_files(
+        [paths[i] for i in need_quick], [stats[i] for i in need_quick], cursor, "quick", prefetch_ahead=False
+    )
+    candidates = []
+    for i, q in zip(need_quick, quick):
+        keys[i] = (stats[i].st_size, int(q, 16)) if q else None
+        if q and stats[i].st_size > 2 * QUICK_BYTES:
+            candidates.append((i, [(family, keys[i]) for family in families[i]]))
+    need_full = _colliding(candidates)
+
+    full = hash_files([paths[i] for i in need_full], [stats[i] for i in need_full], cursor, hash_algo)
+    for i, h in zip(need_full, full):
+        keys[i] = keys[i] + (int(h, 16),) if h else None
+
+    return keys
+
+
+def scan_destination(destination):
+    """Walk destination once. Returns (paths, rel_paths, stats, dir listings)."""
     print("Indexing destination (this is done only once per run)...")
-    count = 0
+    paths, rel_paths, stats = [], [], []
+    listings = {}
+    for path, rel_path, st in walk_files(destination, listings):
+        paths.append(path)
+        rel_paths.append(rel_path)
+        stats.append(st)
+    print(f"Destination index complete: {len(paths):,} files")
+    return paths, rel_paths, stats, listings
 
-    for item in destination.rglob("*"):
-        if not item.is_file():
-            continue
-        try:
-            rel = str(item.relative_to(destination))
-            h = compute_sha256(item)
-            if h:
-                cursor.execute(
-                    "INSERT OR REPLACE INTO dest_hashes (rel_path, file_hash) VALUES (?, ?)",
-                    (rel, h),
-                )
-                count += 1
-                if count % 500 == 0:
-                    print(f"  {count:,} files indexed", end="\r")
-        except Exception as e:
-            print(f"  Skip {item}: {e}", file=sys.stderr)
 
-    conn.commit()
-    print(f"\nDestination index complete: {count:,} files")
+def _kernel_copy(src, dst):
+    """Copy file data without passing it through userspace. Returns False if unsupported.
 
+    Tries a reflink (FICLONE: Btrfs/XFS, metadata-only) first, then
+    os.copy_file_range, which may still reflink or copy server-side.
+    """
+    if FICLONE is None and not hasattr(os, "copy_file_range"):
+        return False
 
-def copy_with_suffix(src, dst):
-    """Copy file, adding _1, _2, … suffix if needed. Returns final path or None."""
-    if not dst.exists():
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+
+        if FICLONE is not None:
+            try:
+                fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                return True
+            except OSError:
+                pass
+
+        if not hasattr(os, "copy_file_range"):
+            return False
+
+        size = os.fstat(src_fd).st_size
+        copied = 0
         try:
-            dst.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copy2(src, dst)
-            return dst
-        except Exception as e:
-            print(f"  Copy failed: {src} → {dst}\n  {e}", file=sys.stderr)
-            return None
+            while copied < size:
+                n = os.copy_file_range(src_fd, dst_fd, size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError as e:
+            if copied == 0 and e.errno in KERNEL_COPY_UNSUPPORTED:
+                return False
+            raise
+        # Some filesystems report success but copy nothing
+        return copied > 0 or size == 0
+
+
+def copy_file(src, dst):
+    """Copy data and metadata like shutil.copy2, preferring in-kernel copies; never overwrites dst."""
+    # Open the source first so an unreadable one never claims a name
+    with open(src, "rb"):
+        open(dst, "xb").close()
+    try:
+        if not _kernel_copy(src, dst):
+            # Uses sendfile on Linux, fcopyfile on macOS
+            shutil.copyfile(src, dst)
+    except BaseException:
+        # Don't leave a partial file to be seen as a conflict next run
+        try:
+            os.unlink(dst)
+        except OSError:
+            pass
+        raise
+    try:
+        shutil.copystat(src, dst)
+    except OSError as e:
+        # The data is complete; e.g. vfat/CIFS targets refuse chmod
+        print(f"  Cannot copy metadata to {dst}: {e}", file=sys.stderr)
+
+
+def _dir_names(dir_names, parent):
+    """Names in directory parent, listed once per run and cached in dir_names."""
+    names = dir_names.get(parent)
+    if names is None:
+        try:
+            with os.scandir(parent) as it:
+                names = {entry.name for entry in it}
+        except OSError:
+            names = set()
+        dir_names[parent] = names
+    return names
+
+
+def plan_destination(dst, same_content=(), planned=(), dir_names=None):
+    """Pick where a source file goes, adding _1, _2, … suffix if needed. Returns (path or None, needs_copy)."""
+    parent, name = os.path.split(dst)
+    names = _dir_names({} if dir_names is None else dir_names, parent)
+    if dst not in planned and name not in names:
+        return dst, True
 
     # File exists → try numbered suffixes
-    stem = dst.stem
-    suffix = dst.suffix
-    parent = dst.parent
+    stem, suffix = split_suffix(name)
 
     for i in range(1, 1001):
-        candidate = parent / f"{stem}_{i}{suffix}"
-        if not candidate.exists():
-            try:
-                shutil.copy2(src, candidate)
-                print(f"  Conflict → saved as {candidate.name}")
-                return candidate
-            except Exception as e:
-                print(f"  Copy failed: {src} → {candidate}\n  {e}", file=sys.stderr)
-                return None
+        candidate_name = suffixed_name(stem, suffix, i)
+        candidate = os.path.join(parent, candidate_name)
+        if candidate not in planned and candidate_name not in names:
+            print(f"  Conflict → saved as {os.path.basename(candidate)}")
+            return candidate, True
 
         # If same content already exists under this name → no need to copy
-        if compute_sha256(candidate) == compute_sha256(src):
-            print(f"  Already exists (same content): {candidate.name}")
-            return candidate
+        if candidate in same_content:
+            print(f"  Already exists (same content): {os.path.basename(candidate)}")
+            return candidate, False
 
     print(f"  Gave up after 1000 attempts: {dst}", file=sys.stderr)
-    return None
+    return None, False
 
 
-def sync_sources_to_dest( sources, destination, db_path="filesync_temp.db", keep_db=False):
+def _copy_one(job):
+    src, dst, base, same_content = job
+    try:
+        try:
+            copy_file(src, dst)
+            return dst
+        except FileExistsError:
+            # The name index missed a file (e.g. on a case-insensitive
+            # filesystem): fall back to names that are free on disk
+            parent, name = os.path.split(base)
+            stem, suffix = split_suffix(name)
+            for i in range(1, 1001):
+                candidate = os.path.join(parent, suffixed_name(stem, suffix, i))
+                if os.path.exists(candidate):
+                    # Same content already there under this name → no copy
+                    if candidate in same_content:
+                        print(f"  Already exists (same content): {os.path.basename(candidate)}")
+                        return candidate
+                    continue
+                try:
+                    copy_file(src, candidate)
+                except FileExistsError:
+                    continue
+                print(f"  Conflict → saved as {os.path.basename(candidate)}")
+                return candidate
+            raise
+    except Exception as e:
+        print(f"  Copy failed: {src} → {dst}\n  {e}", file=sys.stderr)
+        return None
+
+
+def copy_files(jobs):
+    """Run (src, dst, base, same_content) copies concurrently. Returns the final path per job, or None if it failed."""
+    # Create every target directory once, before the copies start
+    for parent in {os.path.dirname(dst) for _, dst, _, _ in jobs}:
+        try:
+            os.makedirs(parent, exist_ok=True)
+        except OSError as e:
+            # The copies into it fail and are reported individually
+            print(f"  Cannot create {parent}: {e}", file=sys.stderr)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=COPY_WORKERS) as ex:
+        return list(ex.map(_copy_one, jobs))
+
+
+def collect_source_files(sources):
+    """Walk every source root once. Returns parallel lists (rel_paths, src_files, stats)."""
+    rel_paths, src_files, stats = [], [], []
+    for src_root in sources:
+        src_root = src_root.resolve()
+        if not src_root.is_dir():
+            print(f"  Not a directory, skipping: {src_root}", file=sys.stderr)
+            continue
+
+        print(f"  Processing source: {src_root}")
+
+        for src_file, rel_path, st in walk_files(src_root):
+            rel_paths.append(rel_path)
+            src_files.append(src_file)
+            stats.append(st)
+    return rel_paths, src_files, stats
+
+
+def sync_sources_to_dest( sources, destination, db_path="files.db", keep_db=False, hash_algo="sha256"):
     if not sources:
         print("Error: at least one source directory is required", file=sys.stderr)
         sys.exit(1)
@@ -120,14 +546,20 @@ def sync_sources_to_dest( sources, destination, db_path="filesync_temp.db", keep
     destination.mkdir(parents=True, exist_ok=True)
 
     # Prepare DB for destination index
-    if os.path.exists(db_path) and not keep_db:
-        os.unlink(db_path)
+    db_files = [db_path, db_path + "-wal", db_path + "-shm"]
+    if not keep_db:
+        for path in db_files:
+            if os.path.exists(path):
+                os.unlink(path)
 
     conn = get_or_create_db(db_path)
     cursor = conn.cursor()
 
     try:
-        build_destination_index(destination, conn, cursor)
+        dest_paths, dest_rel_paths, dest_stats, dir_names = scan_destination(destination)
+        # Destination paths are plain strings built by concatenation: matches
+        # the paths walk_files yields, without an os.path.join per file
+        dest_prefix = os.path.join(os.fspath(destination), "")
 
         total_files = 0
         copied = 0
@@ -136,54 +568,69 @@ def sync_sources_to_dest( sources, destination, db_path="filesync_temp.db", keep
 
         print("\nSyncing sources → destination...")
 
-        for src_root in sources:
-            src_root = src_root.resolve()
-            if not src_root.is_dir():
-                print(f"  Not a directory, skipping: {src_root}", file=sys.stderr)
+        rel_paths, src_files, src_stats = collect_source_files(sources)
+
+        # Destination and sources are keyed together; a file is only ever
+        # compared with same-size files whose names it could conflict with
+        families = [name_families(rel) for rel in dest_rel_paths + rel_paths]
+        keys = content_keys(dest_paths + src_files, dest_stats + src_stats, cursor, hash_algo, families)
+        conn.commit()
+        src_keys = keys[len(dest_paths):]
+        src_families = families[len(dest_paths):]
+
+        # (family, content key) → destination paths with that content.
+        # Keys only prove identity within a family, so never look across.
+        catalog = {}
+        for path, key, path_families in zip(dest_paths, keys, families):
+            if key:
+                for family in path_families:
+                    catalog.setdefault((family, key), set()).add(path)
+
+        jobs = []      # (src, dst, original dst, same_content) copies, run after every name is decided
+        planned = set()
+
+        for rel_path, src_file, src_key, src_family in zip(
+            rel_paths, src_files, src_keys, (f[0] for f in src_families)
+        ):
+            total_files += 1
+            dst_file = dest_prefix + rel_path
+
+            if not src_key:
                 continue
 
-            print(f"  Processing source: {src_root}")
-
-            for src_file in src_root.rglob("*"):
-                if not src_file.is_file():
-                    continue
-
-                total_files += 1
-                rel_path = src_file.relative_to(src_root)
-                dst_file = destination / rel_path
-
-                src_hash = compute_sha256(src_file)
-                if not src_hash:
-                    continue
+            # Destination paths (existing or planned) with this content; also
+            # dedupes identical files at the same path across sources
+            same_content = catalog.get((src_family, src_key), ())
+            if dst_file in same_content:
+                skipped += 1
+                # print(f"  Skip (identical)  {rel_path}")
+                continue
 
-                # Check if we already know this file in destination
-                cursor.execute(
-                    "SELECT file_hash FROM dest_hashes WHERE rel_path = ?",
-                    (str(rel_path),),
-                )
-                row = cursor.fetchone()
+            # Either missing, or content different
+            final_path, needs_copy = plan_destination(dst_file, same_content, planned, dir_names)
 
-                if row and row[0] == src_hash:
-                    skipped += 1
-                    # print(f"  Skip (identical)  {rel_path}")
-                    continue
+            if final_path is None:
+                continue
+            if not needs_copy:
+                skipped += 1
+                continue
 
-                # Either missing, or content different
-                final_path = copy_with_suffix(src_file, dst_file)
-
-                if final_path:
-                    copied += 1
-                    if final_path != dst_file:
-                        conflicted += 1
-                    # Update index so future checks see it
-                    cursor.execute(
-                        "INSERT OR REPLACE INTO dest_hashes (rel_path, file_hash) VALUES (?, ?)",
-                        (str(rel_path if final_path == dst_file else final_path.relative_to(destination)), src_hash),
-                    )
-                    conn.commit()
-                else:
-                    # failed to copy
-                    pass
+            # Snapshot: the catalog set grows with this and later planned copies
+            jobs.append((src_file, final_path, dst_file, frozenset(same_content)))
+            planned.add(final_path)
+            # Update catalog so later sources see the planned copy
+            for family in name_families(final_path[len(dest_prefix):]):
+                catalog.setdefault((family, src_key), set()).add(final_path)
+
+        print(f"  Copying {len(jobs):,} files...")
+        for (_, _, dst_file, same_content), final_path in zip(jobs, copy_files(jobs)):
+            if final_path in same_content:
+                # Found on disk under a name the scan listing missed
+                skipped += 1
+            elif final_path:
+                copied += 1
+                if final_path != dst_file:
+                    conflicted += 1
 
         print("\n" + "="*60)
         print(f"Finished at {datetime.datetime.now():%Y-%m-%d %H:%M:%S}")
@@ -193,12 +640,16 @@ def sync_sources_to_dest( sources, destination, db_path="filesync_temp.db", keep
         print(f"  Conflicts (renamed): {conflicted:,}")
 
     finally:
+        # An unfinished SELECT would keep close() from checkpointing the WAL
+        cursor.close()
         conn.close()
-        if not keep_db and os.path.exists(db_path):
-            try:
-                os.unlink(db_path)
-            except:
-                pass
+        if not keep_db:
+            for path in db_files:
+                if os.path.exists(path):
+                    try:
+                        os.unlink(path)
+                    except:
+                        pass
 
 
 def main():
@@ -219,11 +670,22 @@ def main():
     parser.add_argument(
         "--keep-db",
         action="store_true",
-        help="Keep temporary SQLite database after run",
+        help="Keep the SQLite database (files.db) after run; its hash cache "
+             "lets the next run skip unchanged files",
+    )
+    parser.add_argument(
+        "--hash",
+        default="sha256",
+        choices=["sha256", "blake3"],
+        help="Content hash used to compare files (default: sha256; "
+             "blake3 is faster but needs the 'blake3' package)",
     )
 
     args = parser.parse_args()
 
+    if args.hash == "blake3" and blake3 is None:
+        parser.error("--hash blake3 requires the 'blake3' package (pip install blake3)")
+
     sources = [Path(s).expanduser().resolve() for s in args.source]
     dest = Path(args.destination).expanduser().resolve()
 
@@ -237,6 +699,7 @@ def main():
         sources=sources,
         destination=dest,
         keep_db=args.keep_db,
+        hash_algo=args.hash,
     )
 
 
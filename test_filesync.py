@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 
+import errno
+import hashlib
+import importlib.util
 import os
 import shutil
 import subprocess
@@ -7,6 +10,9 @@ import sys
 import tempfile
 import unittest
 from pathlib import Path
+from unittest import mock
+
+import filesync
 
 
 class TestFileSync(unittest.TestCase):
@@ -37,13 +43,15 @@ class TestFileSync(unittest.TestCase):
         with open(path, "w") as f:
             f.write(content)
 
-    def run_filesync(self, sources: list, destination: str, keep_db: bool = False) -> subprocess.CompletedProcess:
+    def run_filesync(self, sources: list, destination: str, keep_db: bool = False, hash_algo: str = None) -> subprocess.CompletedProcess:
         """Run filesync.py with the given arguments."""
         args = [sys.executable, "filesync.py", "--destination", destination]
         for source in sources:
             args.extend(["--source", source])
         if keep_db:
             args.append("--keep-db")
+        if hash_algo:
+            args.extend(["--hash", hash_algo])
         try:
             return subprocess.run(
                 args,
@@ -165,6 +173,28 @@ class TestFileSync(unittest.TestCase):
         # Database should exist
         self.assertTrue(os.path.exists("files.db"), "Database file was deleted despite --keep-db")
 
+    def test_keep_db_rerun_detects_changes(self):
+        """Test that a kept hash cache does not hide files changed between runs."""
+        result = self.run_filesync(sources=[self.dir_a], destination=self.dir_b, keep_db=True)
+        self.assertEqual(result.returncode, 0, f"Command failed: {result.stderr}")
+
+        # Change a.txt in A after it was hashed and cached
+        self.create_file(os.path.join(self.dir_a, "a.txt"), "Updated content of a.txt")
+
+        result = self.run_filesync(sources=[self.dir_a], destination=self.dir_b, keep_db=True)
+        self.assertEqual(result.returncode, 0, f"Command failed: {result.stderr}")
+
+        self.assertEqual(
+            Path(os.path.join(self.dir_b, "a.txt")).read_text(),
+            "Content of a.txt",
+            "Original a.txt in B was overwritten"
+        )
+        self.assertEqual(
+            Path(os.path.join(self.dir_b, "a_1.txt")).read_text(),
+            "Updated content of a.txt",
+            "Changed a.txt was not saved as a_1.txt"
+        )
+
     def test_no_source_directory(self):
         """Test error handling when no source directory is provided."""
         result = self.run_filesync(sources=[], destination=self.dir_b)
@@ -186,6 +216,20 @@ class TestFileSync(unittest.TestCase):
         # Check error message in stdout
         self.assertIn(f"Error accessing directory '{nonexistent_dir}'", result.stdout)
 
+    @unittest.skipIf(not hasattr(os, "geteuid") or os.geteuid() == 0, "needs a non-root POSIX user")
+    def test_unreadable_source_leaves_no_file(self):
+        """Test that a source that cannot be read leaves nothing behind in the destination."""
+        os.chmod(os.path.join(self.dir_a, "a.txt"), 0)
+        try:
+            for _ in range(2):
+                self.run_filesync(sources=[self.dir_a], destination=self.dir_b)
+        finally:
+            os.chmod(os.path.join(self.dir_a, "a.txt"), 0o644)
+
+        expected_files_b = {"b.txt", "c.txt"}
+        actual_files_b = set(os.listdir(self.dir_b))
+        self.assertEqual(actual_files_b, expected_files_b, "Unexpected files in B")
+
     def test_file_conflict_resolution(self):
         """Test handling of files with same name but different content."""
         # Create a conflicting a.txt in B with different content
@@ -210,6 +254,188 @@ class TestFileSync(unittest.TestCase):
             "Original a.txt in B was overwritten"
         )
 
+    def test_conflict_existing_suffixed_copy(self):
+        """Test that a suffixed copy with identical content is reused, not duplicated."""
+        self.create_file(os.path.join(self.dir_b, "a.txt"), "Different content")
+        self.create_file(os.path.join(self.dir_b, "a_1.txt"), "Content of a.txt")
+
+        result = self.run_filesync(sources=[self.dir_a], destination=self.dir_b)
+        self.assertEqual(result.returncode, 0, f"Command failed: {result.stderr}")
+
+        expected_files_b = {"a.txt", "a_1.txt", "b.txt", "c.txt"}
+        actual_files_b = set(os.listdir(self.dir_b))
+        self.assertEqual(actual_files_b, expected_files_b, "Unexpected files in B")
+
+    def test_conflict_trailing_dot_name(self):
+        """Test that a same-size suffixed copy of a name ending in '.' is not mistaken for the source."""
+        self.create_file(os.path.join(self.dir_a, "x."), "SOURCE-DATA")
+        self.create_file(os.path.join(self.dir_b, "x."), "old")
+        self.create_file(os.path.join(self.dir_b, "x._1"), "OTHER-STUFF")
+
+        result = self.run_filesync(sources=[self.dir_a], destination=self.dir_b)
+        self.assertEqual(result.returncode, 0, f"Command failed: {result.stderr}")
+
+        self.assertEqual(
+            Path(os.path.join(self.dir_b, "x._2")).read_text(),
+            "SOURCE-DATA",
+            "x. was not saved as x._2"
+        )
+        self.assertEqual(
+            Path(os.path.join(self.dir_b, "x._1")).read_text(),
+            "OTHER-STUFF",
+            "x._1 in B was overwritten"
+        )
+
+    def test_conflict_reuses_second_suffix(self):
+        """Test that a_2.txt with identical content is found past a same-size a_1.txt."""
+        self.create_file(os.path.join(self.dir_b, "a.txt"), "Different content")
+        self.create_file(os.path.join(self.dir_b, "a_1.txt"), "Content of x.txt")
+        self.create_file(os.path.join(self.dir_b, "a_2.txt"), "Content of a.txt")
+
+        result = self.run_filesync(sources=[self.dir_a], destination=self.dir_b)
+        self.assertEqual(result.returncode, 0, f"Command failed: {result.stderr}")
+
+        expected_files_b = {"a.txt", "a_1.txt", "a_2.txt", "b.txt", "c.txt"}
+        actual_files_b = set(os.listdir(self.dir_b))
+        self.assertEqual(actual_files_b, expected_files_b, "Unexpected files in B")
+
+    def test_conflict_dotfile_name(self):
+        """Test that dotfiles get suffixed names and are compared with them."""
+        self.create_file(os.path.join(self.dir_a, ".bashrc"), "alias ll=ls")
+        self.create_file(os.path.join(self.dir_b, ".bashrc"), "export A=1")
+        self.create_file(os.path.join(self.dir_b, ".bashrc_1"), "alias ls=ll")
+
+        result = self.run_filesync(sources=[self.dir_a], destination=self.dir_b)
+        self.assertEqual(result.returncode, 0, f"Command failed: {result.stderr}")
+
+        self.assertEqual(
+            Path(os.path.join(self.dir_b, ".bashrc_2")).read_text(),
+            "alias ll=ls",
+            ".bashrc was not saved as .bashrc_2"
+        )
+
+    def test_name_families(self):
+        """Test that suffixed names fall in the family of the name they were derived from."""
+        self.assertIn(("", "a", ".txt"), filesync.name_families("a_2.txt"))
+        self.assertIn(("", "x.", ""), filesync.name_families("x._1"))
+        self.assertIn(("", ".bashrc", ""), filesync.name_families(".bashrc_1"))
+        self.assertIn(("sub", "a.tar", ".gz"), filesync.name_families(os.path.join("sub", "a.tar_1.gz")))
+        self.assertEqual(filesync.name_families("a.txt"), [("", "a", ".txt")])
+
+    def test_content_keys_only_read_within_family(self):
+        """Test that same-size files are only fingerprinted when their names could conflict."""
+        names = ["a.txt", "c.txt", "a_1.txt"]
+        paths = [os.path.join(self.temp_dir, name) for name in names]
+        for path in paths:
+            self.create_file(path, "same size!")
+        stats = [os.stat(path) for path in paths]
+
+        # a.txt and c.txt never meet: keyed by size alone, never read
+        keys = filesync.content_keys(paths[:2], stats[:2], families=[filesync.name_families(n) for n in names[:2]])
+        self.assertEqual(keys, [(10,), (10,)])
+
+        # a.txt and a_1.txt can conflict: both fingerprinted, and equal
+        keys = filesync.content_keys(
+            [paths[0], paths[2]], [stats[0], stats[2]],
+            families=[filesync.name_families(names[0]), filesync.name_families(names[2])],
+        )
+        self.assertEqual(len(keys[0]), 2)
+        self.assertEqual(keys[0], keys[1])
+
+    def test_same_size_differing_middle(self):
+        """Test that files matching in size, head and tail are still told apart."""
+        self.create_file(os.path.join(self.dir_a, "big.txt"), "x" * 20000)
+        self.create_file(os.path.join(self.dir_a, "big_copy.txt"), "x" * 20000)
+        self.create_file(os.path.join(self.dir_b, "big.txt"), "x" * 10000 + "y" + "x" * 9999)
+        self.create_file(os.path.join(self.dir_b, "big_copy.txt"), "x" * 20000)
+
+        result = self.run_filesync(sources=[self.dir_a], destination=self.dir_b)
+        self.assertEqual(result.returncode, 0, f"Command failed: {result.stderr}")
+
+        expected_files_b = {"a.txt", "b.txt", "c.txt", "big.txt", "big_1.txt", "big_copy.txt"}
+        actual_files_b = set(os.listdir(self.dir_b))
+        self.assertEqual(actual_files_b, expected_files_b, "Unexpected files in B")
+        self.assertEqual(
+            Path(os.path.join(self.dir_b, "big_1.txt")).read_text(),
+            "x" * 20000,
+            "big_1.txt content mismatch"
+        )
+
+    @unittest.skipUnless(importlib.util.find_spec("blake3"), "blake3 not installed")
+    def test_hash_blake3(self):
+        """Test that --hash blake3 skips identical files and renames conflicts."""
+        self.create_file(os.path.join(self.dir_b, "a.txt"), "Different content")
+
+        result = self.run_filesync(sources=[self.dir_a], destination=self.dir_b, hash_algo="blake3")
+        self.assertEqual(result.returncode, 0, f"Command failed: {result.stderr}")
+
+        expected_files_b = {"a.txt", "a_1.txt", "b.txt", "c.txt"}
+        actual_files_b = set(os.listdir(self.dir_b))
+        self.assertEqual(actual_files_b, expected_files_b, "Unexpected files in B")
+
+    def test_copy_falls_back_when_name_taken(self):
+        """Test that a copy onto a name the index missed is saved under a free suffix instead."""
+        # What a case-insensitive filesystem looks like to a case-sensitive name index
+        src = os.path.join(self.dir_a, "a.txt")
+        dst = os.path.join(self.dir_b, "b.txt")
+        self.create_file(os.path.join(self.dir_b, "b_1.txt"), "Other content")
+
+        results = filesync.copy_files([(src, dst, dst, frozenset())])
+
+        self.assertEqual(results, [os.path.join(self.dir_b, "b_2.txt")])
+        self.assertEqual(Path(dst).read_text(), "Common content", "b.txt in B was overwritten")
+        self.assertEqual(
+            Path(os.path.join(self.dir_b, "b_2.txt")).read_text(),
+            "Content of a.txt",
+            "b_2.txt content mismatch"
+        )
+
+    def test_copy_fallback_finds_identical_suffixed_copy(self):
+        """Test that the fallback reuses an identical suffixed copy instead of adding another."""
+        src = os.path.join(self.dir_a, "a.txt")
+        dst = os.path.join(self.dir_b, "b.txt")
+        identical = os.path.join(self.dir_b, "b_1.txt")
+        self.create_file(identical, "Content of a.txt")
+
+        results = filesync.copy_files([(src, dst, dst, frozenset([identical]))])
+
+        self.assertEqual(results, [identical])
+        self.assertEqual(set(os.listdir(self.dir_b)), {"b.txt", "b_1.txt", "c.txt"}, "Duplicate copy written")
+
+    def test_hash_large_file(self):
+        """Test that files above MMAP_THRESHOLD hash like hashlib, mapped or not."""
+        path = os.path.join(self.temp_dir, "large.bin")
+        data = os.urandom(filesync.MMAP_THRESHOLD + 12345)
+        with open(path, "wb") as f:
+            f.write(data)
+        expected = hashlib.sha256(data).hexdigest()
+
+        self.assertEqual(filesync.compute_sha256(path), expected)
+        # Mounts that refuse mmap fall back to read()
+        with mock.patch("filesync.mmap.mmap", side_effect=OSError(errno.ENODEV, "No such device")):
+            self.assertEqual(filesync.compute_sha256(path), expected)
+
+    def test_copy_keeps_data_when_metadata_fails(self):
+        """Test that a failed copystat keeps the copied file."""
+        src = os.path.join(self.dir_a, "a.txt")
+        dst = os.path.join(self.dir_b, "a.txt")
+
+        with mock.patch("filesync.shutil.copystat", side_effect=PermissionError(errno.EPERM, "Operation not permitted")):
+            filesync.copy_file(src, dst)
+
+        self.assertEqual(Path(dst).read_text(), "Content of a.txt", "a.txt in B was removed")
+
+    @unittest.skipUnless(importlib.util.find_spec("cryptography"), "cryptography not installed")
+    def test_hash_cryptography_sha256(self):
+        """Test that the cryptography SHA-256 path matches hashlib."""
+        path = os.path.join(self.dir_a, "a.txt")
+        expected = hashlib.sha256(b"Content of a.txt").hexdigest()
+
+        with mock.patch.multiple(
+            filesync, USE_CRYPTOGRAPHY_SHA256=True, crypto_hashes=filesync.import_crypto_hashes()
+        ):
+            self.assertEqual(filesync.compute_sha256(path), expected)
+
     def test_subdirectories(self):
         """Test syncing files in subdirectories."""
         # Create subdirectory in A with a file